@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+import os
+import tempfile
+from collections.abc import Iterator
+from contextlib import contextmanager, suppress
+from pathlib import Path
+from typing import BinaryIO
+
+
+@contextmanager
+def atomic_write(path: Path, *, durable: bool = True) -> Iterator[BinaryIO]:
+    """Yield a binary stream whose contents replace the given path in one
+    go once the block exits successfully. On failure the original file is
+    left untouched (and no half-written file is left behind).
+
+    Unless durable is False, the contents are also flushed to the disk
+    before the replacement (so they survive a power loss as well)."""
+
+    temp_fd, temp_file = tempfile.mkstemp(
+        prefix=f".{path.stem}.", suffix=f"{path.suffix}.tmp", dir=path.parent
+    )
+    try:
+        with open(temp_fd, "wb") as stream:
+            yield stream
+            if durable:
+                stream.flush()
+                os.fsync(stream.fileno())
+        os.replace(temp_file, path)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.unlink(temp_file)
+        raise
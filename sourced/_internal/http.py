@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import base64
+import http.client
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+from urllib.error import HTTPError, URLError
+from urllib.parse import unquote, urljoin, urlsplit, urlunsplit
+from urllib.request import getproxies, proxy_bypass
+
+_REDIRECT_CODES = frozenset({301, 302, 303, 307, 308})
+_MAX_REDIRECTS = 5
+
+_local = threading.local()
+
+
+def _get_connection(
+    scheme: str,
+    netloc: str,
+) -> tuple[http.client.HTTPConnection, dict[str, str] | None]:
+    """Return the keep-alive connection of the current thread for the
+    given host (creating it if necessary), along with the headers for the
+    plain HTTP proxy it goes through (if there is any)."""
+    connections = _local.__dict__.setdefault("connections", {})
+    if (scheme, netloc) not in connections:
+        connections[scheme, netloc] = _connect(scheme, netloc)
+    return connections[scheme, netloc]
+
+
+def _connect(
+    scheme: str,
+    netloc: str,
+) -> tuple[http.client.HTTPConnection, dict[str, str] | None]:
+    if scheme == "https":
+        connection_class: type[http.client.HTTPConnection] = http.client.HTTPSConnection
+    elif scheme == "http":
+        connection_class = http.client.HTTPConnection
+    else:
+        raise URLError(f"unsupported URL scheme: {scheme!r}")
+
+    # Honor the same proxy settings (e.g. https_proxy, no_proxy) as urlopen().
+    proxy = getproxies().get(scheme)
+    if proxy is None or proxy_bypass(netloc):
+        return connection_class(netloc), None
+
+    if "://" not in proxy:
+        proxy = "http://" + proxy
+    proxy_parts = urlsplit(proxy)
+    proxy_headers = {}
+    if proxy_parts.username is not None:
+        credentials = (
+            f"{unquote(proxy_parts.username)}:{unquote(proxy_parts.password or '')}"
+        )
+        proxy_headers["Proxy-Authorization"] = "Basic " + base64.b64encode(
+            credentials.encode()
+        ).decode("ascii")
+
+    proxy_netloc = proxy_parts.netloc.rpartition("@")[2]
+    connection = connection_class(proxy_netloc)
+    if scheme == "https":
+        # Tunnel through the proxy, the rest is end-to-end encrypted.
+        connection.set_tunnel(netloc, headers=proxy_headers)
+        return connection, None
+    else:
+        return connection, proxy_headers
+
+
+def _send(
+    connection: http.client.HTTPConnection,
+    target: str,
+    headers: dict[str, str],
+) -> http.client.HTTPResponse:
+    try:
+        connection.request("GET", target, headers=headers)
+        return connection.getresponse()
+    except (http.client.HTTPException, ConnectionError):
+        # The server might have dropped an idle keep-alive connection, so
+        # give it one more chance on a fresh socket.
+        connection.close()
+        connection.request("GET", target, headers=headers)
+        return connection.getresponse()
+
+
+@contextmanager
+def get(
+    url: str,
+    headers: dict[str, str] | None = None,
+) -> Iterator[http.client.HTTPResponse]:
+    """Issue a GET request over a connection that is kept alive (and
+    re-used) by the calling thread. Mirrors urlopen() by raising URLError
+    (or HTTPError for non-successful responses) on failures."""
+
+    headers = headers or {}
+    for _ in range(_MAX_REDIRECTS):
+        parts = urlsplit(url)
+        connection, proxy_headers = _get_connection(parts.scheme, parts.netloc)
+        if proxy_headers is None:
+            target = parts.path or "/"
+            if parts.query:
+                target += "?" + parts.query
+            request_headers = headers
+        else:
+            # Plain HTTP proxies expect the absolute URL as the target.
+            target = urlunsplit(parts._replace(fragment=""))
+            request_headers = {**headers, **proxy_headers}
+
+        try:
+            response = _send(connection, target, request_headers)
+        except (OSError, http.client.HTTPException) as exc:
+            connection.close()
+            raise URLError(exc) from exc
+
+        if response.status in _REDIRECT_CODES and response.getheader("Location"):
+            response.read()
+            url = urljoin(url, response.getheader("Location"))
+            continue
+        elif response.status >= 400:
+            response.read()
+            raise HTTPError(url, response.status, response.reason, response.msg, None)
+
+        try:
+            yield response
+        finally:
+            # A partially consumed response leaves the connection in an
+            # unusable state, so start over with a new one next time.
+            if not response.isclosed():
+                connection.close()
+        return
+
+    raise URLError(f"too many redirects for {url}")
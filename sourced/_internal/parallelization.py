@@ -1,22 +1,80 @@
 from __future__ import annotations
 
+import math
 import os
+import queue
 from collections.abc import Iterator
 from concurrent import futures
+from contextlib import suppress
+from functools import lru_cache
 from itertools import islice
+from pathlib import Path
 from typing import Callable, Literal, TypeVar
 
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None  # type: ignore[assignment]
+
 InputType = TypeVar("InputType")
 ReturnType = TypeVar("ReturnType")
 
 
+# Past this many concurrent connections, PyPI starts rate limiting us
+# anyway; more threads only cost memory and context switches.
+_MAX_IO_WORKERS = 256
+# Number of files we'd like to be able to keep open at once; every I/O
+# worker might hold a few of them (a socket, an archive, a directory, etc.)
+_OPEN_FILES_LIMIT = 16 * 1024
+
+
+def _cgroup_cpu_limit() -> int | None:
+    """Return the CPU quota imposed on the current cgroup (e.g. inside
+    a container), if there is any."""
+    try:
+        # cgroup v2
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()
+    except (OSError, ValueError):
+        try:
+            # cgroup v1
+            quota = Path("/sys/fs/cgroup/cpu/cpu.cfs_quota_us").read_text()
+            period = Path("/sys/fs/cgroup/cpu/cpu.cfs_period_us").read_text()
+        except OSError:
+            return None
+
+    try:
+        quota_us, period_us = int(quota), int(period)
+    except ValueError:
+        # "max" (v2) means there is no quota.
+        return None
+
+    if quota_us <= 0 or period_us <= 0:
+        return None
+    return max(1, math.ceil(quota_us / period_us))
+
+
+@lru_cache
+def available_cpus() -> int:
+    """Return the number of CPUs the current process can actually
+    use, taking the affinity mask and the cgroup quota into account."""
+    if hasattr(os, "sched_getaffinity"):
+        count = len(os.sched_getaffinity(0))
+    else:
+        count = os.cpu_count() or 4
+
+    if limit := _cgroup_cpu_limit():
+        count = min(count, limit)
+    return count
+
+
 def workers(*, heavy: Literal["io", "cpu", "both"]) -> int:
     """Return the number of workers to use for the given
     heavy workload type."""
-    cpu_count = os.cpu_count() or 4
+    cpu_count = available_cpus()
 
     if heavy == "io":
-        return cpu_count * 4
+        return min(cpu_count * 4, _MAX_IO_WORKERS)
     elif heavy == "cpu":
         return round(cpu_count * 1.25)
     elif heavy == "both":
@@ -25,30 +83,56 @@ def workers(*, heavy: Literal["io", "cpu", "both"]) -> int:
         raise ValueError(f"Invalid heavy workload type: {heavy!r}")
 
 
+def raise_open_files_limit() -> None:
+    """Raise the soft limit on the number of open files of the current
+    process as far as the hard limit allows, since the default one (as low
+    as 256 on macOS) is easily exhausted by that many I/O workers."""
+    if resource is None:
+        return
+
+    soft_limit, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target_limit = _OPEN_FILES_LIMIT
+    if hard_limit != resource.RLIM_INFINITY:
+        target_limit = min(target_limit, hard_limit)
+
+    if soft_limit != resource.RLIM_INFINITY and soft_limit < target_limit:
+        # The hard limit might still be above what the kernel allows (e.g.
+        # kern.maxfilesperproc on macOS); keep going with what we have.
+        with suppress(ValueError, OSError):
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target_limit, hard_limit))
+
+
 def buffered_execution(
     executor: futures.Executor,
     iterator: Iterator[InputType],
     target_func: Callable[[InputType], ReturnType],
     /,
     max_buffered_tasks: int,
-    _per_check_delay: float = 0.25,
 ) -> Iterator[set[futures.Future[ReturnType]]]:
     """Execute the target function over the input values obtained
     from the iterator in a buffered manner. Will yield a set of
-    results for each batch of tasks that have been completed on
-    each iteration (_per_check_delay seconds)."""
-
-    running_tasks: set[futures.Future[ReturnType]] = set()
-    while True:
-        inputs = list(islice(iterator, max_buffered_tasks - len(running_tasks)))
-        if not inputs and not running_tasks:
-            break
-
-        running_tasks.update(
-            executor.submit(target_func, input_value) for input_value in inputs
-        )
-        completed_tasks, running_tasks = futures.wait(
-            running_tasks,
-            timeout=_per_check_delay,
-        )
+    completed tasks as soon as any of them finishes, and top up the
+    buffer with the same number of new tasks."""
+
+    completed_queue: queue.SimpleQueue[futures.Future[ReturnType]] = queue.SimpleQueue()
+
+    def submit(num_tasks: int) -> int:
+        num_submitted = 0
+        for input_value in islice(iterator, num_tasks):
+            task = executor.submit(target_func, input_value)
+            task.add_done_callback(completed_queue.put)
+            num_submitted += 1
+        return num_submitted
+
+    num_running_tasks = submit(max_buffered_tasks)
+    while num_running_tasks:
+        completed_tasks = {completed_queue.get()}
+        # Collect everything else that has finished in the meantime
+        # without blocking.
+        with suppress(queue.Empty):
+            while True:
+                completed_tasks.add(completed_queue.get_nowait())
+
+        num_running_tasks -= len(completed_tasks)
+        num_running_tasks += submit(len(completed_tasks))
         yield completed_tasks
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import codecs
+import json
+import re
+from collections.abc import Iterator
+from typing import Any, BinaryIO
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
+
+def dumps(obj: Any) -> bytes:
+    """Serialize the given object to JSON encoded bytes. Uses orjson
+    when it is available (sourced[fast])."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    else:
+        return json.dumps(obj).encode()
+
+
+def loads(data: bytes | str) -> Any:
+    """Deserialize the given JSON document. Uses orjson when it is
+    available (sourced[fast])."""
+    if orjson is not None:
+        return orjson.loads(data)
+    else:
+        return json.loads(data)
+
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def iter_array(
+    stream: BinaryIO,
+    key: str,
+    *,
+    chunk_size: int = 64 * 1024,
+) -> Iterator[Any]:
+    """Incrementally decode the items of the array stored under the given
+    key (its first occurrence) of the JSON document in the stream, without
+    ever loading the whole document into memory."""
+
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer, position, exhausted = "", 0, False
+
+    def read_more() -> bool:
+        nonlocal buffer, position, exhausted
+        if exhausted:
+            return False
+
+        chunk = stream.read(chunk_size)
+        exhausted = not chunk
+        buffer = buffer[position:] + text_decoder.decode(chunk, final=exhausted)
+        position = 0
+        return True
+
+    array_start = re.compile(rf'"{re.escape(key)}"\s*:\s*\[')
+    while not (match := array_start.search(buffer)):
+        if not read_more():
+            raise ValueError(f"no array found under {key!r}")
+    position = match.end()
+
+    while True:
+        whitespace = _WHITESPACE.match(buffer, position)
+        # The pattern matches the empty string, so it can't fail.
+        assert whitespace is not None
+        position = whitespace.end()
+        if position == len(buffer):
+            if not read_more():
+                raise ValueError("unexpected end of the JSON document")
+        elif buffer[position] == "]":
+            return
+        elif buffer[position] == ",":
+            position += 1
+        else:
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if read_more():
+                    continue
+                raise
+
+            # A scalar at the very end of the buffer might continue in the
+            # next chunk (e.g. a number), so only trust it with more data.
+            if end == len(buffer) and read_more():
+                continue
+
+            yield item
+            position = end
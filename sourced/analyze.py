@@ -1,50 +1,179 @@
 from __future__ import annotations
 
-import glob
-from collections.abc import Iterator
-from concurrent.futures import Future, ProcessPoolExecutor, as_completed, wait
+import multiprocessing
+import os
+import sys
+import threading
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import suppress
 from dataclasses import dataclass, field
 from itertools import islice
-from typing import Callable, TypeVar
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, TypeVar
 
-try:
+if sys.version_info >= (3, 12):
     from itertools import batched
-except ImportError:
+else:
     # https://docs.python.org/3.12/library/itertools.html#itertools.batched
+    #
+    # Batches are handed to other threads/processes, so unlike a lazy
+    # islice() view over the shared iterator they need to be materialized.
     def batched(iterable, n):
         if n < 1:
             raise ValueError("n must be at least one")
         it = iter(iterable)
-        while batch := list(islice(it, n)):
+        while batch := tuple(islice(it, n)):
             yield batch
 
 
 from rich.console import Console
-from rich.progress import Progress, track
+from rich.progress import Progress
 
-from sourced._internal.parallelization import workers
-from sourced.dataset.db import GlobalStore
+from sourced._internal.files import atomic_write
+from sourced._internal.parallelization import raise_open_files_limit, workers
+from sourced.dataset.db import DEFAULT_DATASET_CACHE_FILE_NAME, Dataset, GlobalStore
 
-# Number of sources per scan task
-_SCAN_TASK_BATCH_SIZE = 64
+# Number of sources per scan task. Scanning happens on threads, so
+# small batches are cheap and spread uneven projects across workers.
+_SCAN_TASK_BATCH_SIZE = 4
+# Default number of files sent to an analysis worker at once
+DEFAULT_CHUNK_SIZE = 64
+# Directories that never contain any sources worth analyzing (hidden ones,
+# e.g. .git or .tox, are skipped as well)
+_SKIPPED_DIRS = frozenset({"__pycache__", "node_modules"})
+# Where the scanned files of a dataset are cached (hidden, so that the
+# scanner never picks it up as a part of any project)
+_FILE_LIST_CACHE_DIR = ".cache"
 
 
-def scan_projects(projects: list[str]) -> list[str]:
-    return [
-        file
-        for project in projects
-        for file in glob.iglob(f"{project}/**/*.py", recursive=True)
-    ]
+def scan_projects(projects: Iterable[str]) -> list[str]:
+    """Collect all the python files under the given projects, skipping
+    hidden directories and the ones that can't contain any sources."""
+
+    # This loop runs for every single entry of every project, so keep the
+    # per-entry work down to a few plain operations.
+    files: list[str] = []
+    add_file = files.append
+    # Walk depth-first off a plain list, which keeps far fewer directories
+    # pending at a time than a breadth-first walk over wide trees.
+    pending_dirs = list(projects)
+    add_dir, next_dir = pending_dirs.append, pending_dirs.pop
+    while pending_dirs:
+        try:
+            entries = os.scandir(next_dir())
+        except OSError:
+            continue
+
+        with entries:
+            for entry in entries:
+                name = entry.name
+                if name[0] == ".":
+                    continue
+
+                # The file type is already known from the directory listing,
+                # so unless it is a symlink this does not require a stat().
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+
+                if is_dir:
+                    if name not in _SKIPPED_DIRS:
+                        add_dir(entry.path)
+                elif name[-3:] == ".py":
+                    add_file(entry.path)
+    return files
+
+
+def _file_list_cache_path(dataset: Dataset) -> Path | None:
+    # The metadata is re-written (replaced) whenever the sources of the
+    # dataset change (e.g. new downloads), so its identity is a cheap version.
+    # The mtime alone might not change between two writes within the same
+    # timestamp tick, hence the inode and the size are a part of it too.
+    try:
+        metadata = os.stat(dataset.path / DEFAULT_DATASET_CACHE_FILE_NAME)
+    except OSError:
+        return None
+
+    version = f"{metadata.st_ino}-{metadata.st_mtime_ns}-{metadata.st_size}"
+    return dataset.path / _FILE_LIST_CACHE_DIR / f"files.{version}.txt"
+
+
+def _read_file_list(path: Path) -> list[str] | None:
+    try:
+        data = path.read_bytes()
+    except OSError:
+        return None
+    # Each path is terminated by a NUL, the only character it can't contain.
+    return os.fsdecode(data).split("\0")[:-1]
+
+
+def _write_file_list(path: Path, batches: Iterable[list[str]]) -> Iterator[list[str]]:
+    """Pass the given batches of files through while writing them to the
+    given path, which only appears once all of them are consumed. The file
+    list is merely a cache, so failing to write it is not an error."""
+
+    stream: BinaryIO | None = None
+    write_failed = consumed = False
+    try:
+        path.parent.mkdir(exist_ok=True)
+        # A lost file list only means scanning again, so don't wait on the disk.
+        with atomic_write(path, durable=False) as stream:
+            for batch in batches:
+                if not write_failed:
+                    try:
+                        stream.write(
+                            os.fsencode("".join(file + "\0" for file in batch))
+                        )
+                    except OSError:
+                        write_failed = True
+                yield batch
+
+            consumed = True
+            if write_failed:
+                # Discard the incomplete list
+                raise OSError(f"failed to write {path}")
+    except OSError:
+        if stream is None:
+            # Couldn't even start writing it, so just pass the files through.
+            yield from batches
+        elif not consumed:
+            # Raised by the batches themselves rather than the cache
+            raise
+        return
+
+    for stale_path in path.parent.glob("files.*.txt"):
+        if stale_path != path:
+            with suppress(OSError):
+                stale_path.unlink()
 
 
 ReturnType = TypeVar("ReturnType")
 
+# The analysis function of the current worker process, set once by the
+# pool's initializer so it doesn't have to be pickled with every task.
+_analysis_func: Callable[[str], Any] | None = None
+
+
+def _init_analysis_worker(analysis_func: Callable[[str], Any]) -> None:
+    global _analysis_func
+    _analysis_func = analysis_func
+
+
+def _analyze_file(file: str) -> Any:
+    assert _analysis_func is not None
+    return _analysis_func(file)
+
 
 @dataclass
 class Sourced:
     num_processes: int = workers(heavy="both")
     store: GlobalStore = field(default_factory=GlobalStore.from_file)
     console: Console = field(default_factory=Console)
+    # Cheap analyses benefit from bigger chunks (less IPC per file),
+    # expensive ones from smaller chunks (better balance between workers).
+    chunk_size: int = DEFAULT_CHUNK_SIZE
 
     def run_on(
         self,
@@ -64,53 +193,104 @@ class Sourced:
         ]
 
         self.console.print("Found", len(sources), "sources")
-        all_files = []
-        with ProcessPoolExecutor(max_workers=self.num_processes) as executor:
-            scan_futures = [
-                executor.submit(scan_projects, batch)
-                for batch in batched(sources, n=_SCAN_TASK_BATCH_SIZE)
-            ]
-
-            for future in track(
-                as_completed(scan_futures),
-                console=self.console,
-                transient=True,
-                description="Scanning python files :eyes:",
-                total=len(scan_futures),
-            ):
-                all_files.extend(future.result())
-
-            self.console.print(
-                f"Collected {len(all_files)} files from {len(sources)} unique projects."
-            )
-
-            if filter_func:
-                all_files = list(filter(filter_func, all_files))
-                self.console.print(
-                    f"Filtered to {len(all_files)} files using the provided filter."
+        if not sources:
+            return
+
+        # Re-scanning a big dataset takes a while, so re-use the files from
+        # the previous run as long as the dataset hasn't changed since then.
+        cache_path = _file_list_cache_path(dataset)
+        cached_files = _read_file_list(cache_path) if cache_path else None
+
+        raise_open_files_limit()
+        # The workers are forked off on most platforms, so start them before
+        # anything else spawns a thread (forking a multi-threaded process is
+        # prone to deadlocks). Scanning is bound by the filesystem, so a thread
+        # pool is cheaper than paying for the pickling of all the collected
+        # paths between processes.
+        with multiprocessing.Pool(
+            processes=self.num_processes,
+            initializer=_init_analysis_worker,
+            initargs=(analysis_func,),
+        ) as pool, ThreadPoolExecutor(
+            max_workers=workers(heavy="io")
+        ) as scan_executor, Progress(
+            transient=True, console=self.console
+        ) as progress:
+            # Unknown until the first scan batch is done
+            file_tracker = progress.add_task("Files", total=None)
+
+            def scan_files() -> Iterator[list[str]]:
+                if len(sources) <= _SCAN_TASK_BATCH_SIZE:
+                    # Not worth starting any threads for a handful of sources
+                    yield scan_projects(sources)
+                    return
+
+                scan_futures = [
+                    scan_executor.submit(scan_projects, batch)
+                    for batch in batched(sources, n=_SCAN_TASK_BATCH_SIZE)
+                ]
+                scan_tracker = progress.add_task(
+                    "Scanning python files :eyes:", total=len(scan_futures)
                 )
+                for future in as_completed(scan_futures):
+                    progress.update(scan_tracker, advance=1)
+                    yield future.result()
+                progress.remove_task(scan_tracker)
 
-            with Progress(transient=True, console=self.console) as progress:
-                file_tracker = progress.add_task("Files", total=len(all_files))
+            if cached_files is not None:
+                file_batches: Iterable[list[str]] = [cached_files]
+            elif cache_path is not None:
+                file_batches = _write_file_list(cache_path, scan_files())
+            else:
+                file_batches = scan_files()
 
-                running_futures: set[Future[ReturnType]] = set()
-                left_files = iter(all_files)
-                max_task_buffer = self.num_processes * 64
+            def collect_files() -> Iterator[str]:
+                # Stream the files to the analysis stage as soon as each
+                # scan batch is done rather than materializing all of them.
+                num_files = num_filtered_files = 0
+                for files in file_batches:
+                    num_files += len(files)
+                    if filter_func:
+                        files = list(filter(filter_func, files))
+                    num_filtered_files += len(files)
 
-                while True:
-                    files = list(
-                        islice(left_files, max_task_buffer - len(running_futures))
-                    )
-                    if not files and not running_futures:
-                        break
+                    progress.update(file_tracker, total=num_filtered_files)
+                    yield from files
 
-                    running_futures.update(
-                        executor.submit(analysis_func, file) for file in files
-                    )
-                    completed_futures, running_futures = wait(
-                        running_futures, timeout=0.25
+                self.console.print(
+                    f"Collected {num_files} files from {len(sources)} unique projects."
+                )
+                if filter_func:
+                    self.console.print(
+                        f"Filtered to {num_filtered_files} files using the"
+                        " provided filter."
                     )
-                    progress.update(file_tracker, advance=len(completed_futures))
 
-                    for future in completed_futures:
-                        yield future.result()
+            # The pool queues up the results without any limit, so stop feeding
+            # it files whenever the caller falls behind on consuming them.
+            result_slots = threading.Semaphore(self.num_processes * self.chunk_size * 2)
+            stopped = threading.Event()
+
+            def throttle_files(files: Iterator[str]) -> Iterator[str]:
+                for file in files:
+                    result_slots.acquire()
+                    if stopped.is_set():
+                        return
+                    yield file
+
+            try:
+                # The pool sends the files to the workers in chunks, and
+                # pickles the results back in chunks as well.
+                for result in pool.imap_unordered(
+                    _analyze_file,
+                    throttle_files(collect_files()),
+                    chunksize=self.chunk_size,
+                ):
+                    result_slots.release()
+                    progress.update(file_tracker, advance=1)
+                    yield result
+            finally:
+                # Terminating the pool waits for the thread that feeds it, so
+                # wake it up in case it is waiting for a slot.
+                stopped.set()
+                result_slots.release()
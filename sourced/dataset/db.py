@@ -1,15 +1,21 @@
 from __future__ import annotations
 
-import json
+import gc
 import os
-import tempfile
+import sys
+from collections.abc import Iterator
+from contextlib import contextmanager
 from dataclasses import dataclass, field
 from enum import Enum
+from functools import partial
+from itertools import islice
 from pathlib import Path
 from typing import Any
 
 from platformdirs import user_cache_path, user_config_path
 
+from sourced._internal import files, serialization
+
 GLOBAL_CONFIG_VERSION = "0.0.1"
 GLOBAL_DATA_VERSION = "0.0.1"
 
@@ -31,8 +37,52 @@ SOURCED_DATA_DIR.mkdir(parents=True, exist_ok=True)
 DEFAULT_DATASET_CACHE_FILE_NAME = "datasets.json"
 JSONType = dict[str, Any]
 
+# Number of sources encoded at once when caching a dataset
+_CACHE_ENCODING_BATCH_SIZE = 1024
 
-@dataclass
+# A dataset might hold hundreds of thousands of sources, so drop the
+# per-instance __dict__ where slotted dataclasses are available (3.10+).
+_SLOTTED = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+
+def _read_json(path: Path) -> JSONType:
+    with open(path, "rb") as stream:
+        return serialization.loads(stream.read())
+
+
+@contextmanager
+def _gc_paused() -> Iterator[None]:
+    # Building up hundreds of thousands of (acyclic) objects in one go
+    # triggers lots of useless collections; skip them until we are done.
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+def _join_path(base: Path, relative_path: str) -> Path:
+    # Most sources live right under their dataset's directory, where the
+    # full path parsing of Path.__truediv__ dominates the time it takes to
+    # load a large dataset. Take the shortcut glob uses for plain names.
+    if (
+        _make_child_relpath is not None
+        and relative_path not in _SPECIAL_PATH_NAMES
+        and os.sep not in relative_path
+        and (os.altsep is None or os.altsep not in relative_path)
+    ):
+        return _make_child_relpath(base, relative_path)
+    else:
+        return base / relative_path
+
+
+_make_child_relpath = getattr(Path, "_make_child_relpath", None)
+_SPECIAL_PATH_NAMES = frozenset({"", ".", ".."})
+
+
+@dataclass(**_SLOTTED)
 class Dataset:
     name: str
     path: Path
@@ -41,48 +91,96 @@ class Dataset:
     @classmethod
     def from_cache(cls, cache_dir: Path) -> Dataset:
         meta_path = cache_dir / DEFAULT_DATASET_CACHE_FILE_NAME
-        if not meta_path.exists():
+        try:
+            json_data = _read_json(meta_path)
+        except FileNotFoundError:
             raise FileNotFoundError(
                 f"Dataset metadata file ({meta_path}) was not found."
-            )
+            ) from None
 
-        with open(meta_path) as stream:
-            return cls.from_json(json.load(stream))
+        return cls.from_json(json_data)
 
-    def cache(self) -> None:
-        """Cache the dataset metadata."""
+    def cache(self, *, durable: bool = True) -> None:
+        """Cache the dataset metadata. Pass durable=False to skip waiting
+        for it to reach the disk (e.g. for intermediate checkpoints)."""
 
         meta_path = self.path / DEFAULT_DATASET_CACHE_FILE_NAME
-        temp_fd, temp_file = tempfile.mkstemp(suffix=meta_path.suffix, dir=self.path)
-        with open(temp_fd, "w") as stream:
-            json.dump(self.to_json(), stream)
-        os.replace(temp_file, meta_path)
+        # Losing the metadata means re-indexing (and re-downloading) the whole
+        # dataset, so never leave a half-written file behind; even on a crash.
+        with files.atomic_write(meta_path, durable=durable) as stream:
+            stream.writelines(self._encode_json())
+
+    def _encode_json(self) -> Iterator[bytes]:
+        # Produces the same document as to_json(), but only encodes a batch
+        # of sources at a time rather than materializing all of them first.
+        header = serialization.dumps(
+            {"name": self.name, "path": str(self.path), "sources": []}
+        )
+        assert header.endswith(b"[]}")
+        yield header[: -len(b"]}")]
 
-    def to_json(self) -> JSONType:
-        # When serializing, use paths relative to the path of
-        # this dataset.
+        sources = self._sources_to_json()
+        separator = b""
+        while batch := list(islice(sources, _CACHE_ENCODING_BATCH_SIZE)):
+            # Strip the brackets, so batches can be stitched together.
+            yield separator + serialization.dumps(batch)[1:-1]
+            separator = b","
+        yield b"]}"
 
+    def to_json(self) -> JSONType:
         return {
             "name": self.name,
             "path": str(self.path),
-            "sources": [
-                source.to_json(
-                    relative_to=self.path,
-                )
-                for source in self.sources
-            ],
+            "sources": list(self._sources_to_json()),
         }
 
+    def _sources_to_json(self) -> Iterator[JSONType]:
+        # When serializing, use paths relative to the path of
+        # this dataset.
+        #
+        # This is equivalent to calling Source.to_json() on each source,
+        # but for the common case of a source residing under the dataset it
+        # slices the path string instead of going through relative_to().
+        prefix = os.path.join(self.path, "")
+        prefix_length = len(prefix)
+
+        for source in self.sources:
+            if source.path is None:
+                path = None
+            elif (path := str(source.path)).startswith(prefix):
+                path = path[prefix_length:]
+            else:
+                path = str(source.path.relative_to(self.path))
+
+            yield {
+                "name": source.name,
+                "path": path,
+                "status": _STATUS_NAMES[source.status],
+            }
+
     @classmethod
     def from_json(cls, json_data: JSONType) -> Dataset:
         dataset_path = Path(json_data["path"])
+
+        # This is equivalent to calling Source.from_json() on each source, but
+        # with everything it needs bound to locals, and without going through
+        # a method call per source.
+        join_path = partial(_join_path, dataset_path)
+        statuses = _STATUSES_BY_NAME
+        with _gc_paused():
+            sources = [
+                Source(
+                    source["name"],
+                    None if source["path"] is None else join_path(source["path"]),
+                    statuses[source["status"]],
+                )
+                for source in json_data["sources"]
+            ]
+
         return cls(
             name=json_data["name"],
             path=dataset_path,
-            sources=[
-                Source.from_json(source, relative_to=dataset_path)
-                for source in json_data["sources"]
-            ],
+            sources=sources,
         )
 
 
@@ -92,7 +190,13 @@ class SourceStatus(Enum):
     SKIPPED = "SKIPPED"
 
 
-@dataclass
+# Plain dict lookups are much cheaper than going through the Enum machinery
+# for each of the (potentially many) sources.
+_STATUSES_BY_NAME = {status.name: status for status in SourceStatus}
+_STATUS_NAMES = {status: status.name for status in SourceStatus}
+
+
+@dataclass(**_SLOTTED)
 class Source:
     name: str
     path: Path | None = None
@@ -101,14 +205,14 @@ class Source:
     @classmethod
     def from_json(cls, json_data: JSONType, relative_to: Path) -> Source:
         if json_data["path"] is not None:
-            path = relative_to / json_data["path"]
+            path = _join_path(relative_to, json_data["path"])
         else:
             path = None
 
         return cls(
             name=json_data["name"],
             path=path,
-            status=SourceStatus(json_data["status"]),
+            status=_STATUSES_BY_NAME[json_data["status"]],
         )
 
     def to_json(self, relative_to: Path) -> JSONType:
@@ -120,7 +224,7 @@ class Source:
         return {
             "name": self.name,
             "path": path,
-            "status": self.status.name,
+            "status": _STATUS_NAMES[self.status],
         }
 
 
@@ -134,11 +238,12 @@ class GlobalStore:
         cls,
         path: Path = SOURCED_CONFIG_DIR / "store.json",
     ) -> GlobalStore:
-        if not path.exists():
+        try:
+            json_data = _read_json(path)
+        except FileNotFoundError:
             return cls(path)
 
-        with open(path) as stream:
-            return cls.from_json(path, json.load(stream))
+        return cls.from_json(path, json_data)
 
     @classmethod
     def from_json(cls, path: Path, json_data: JSONType) -> GlobalStore:
@@ -168,15 +273,13 @@ class GlobalStore:
             ],
         }
 
-    def cache(self) -> None:
-        """Cache the global store metadata."""
+    def cache(self, *, durable: bool = True) -> None:
+        """Cache the global store metadata. Pass durable=False to skip
+        waiting for it to reach the disk."""
 
-        temp_fd, temp_file = tempfile.mkstemp(
-            suffix=self.path.suffix, dir=self.path.parent
-        )
-        with open(temp_fd, "w") as stream:
-            json.dump(self.to_json(), stream)
-        os.replace(temp_file, self.path)
+        # Serialized upfront, so the whole document goes out in a single write.
+        with files.atomic_write(self.path, durable=durable) as stream:
+            stream.write(serialization.dumps(self.to_json()))
 
 
 load = Dataset.from_cache
@@ -1,8 +1,10 @@
 from __future__ import annotations
 
-import json
-import shutil
 import os
+import shutil
+import tempfile
+import threading
+import time
 from collections.abc import Iterator
 from concurrent import futures
 from contextlib import contextmanager, suppress
@@ -11,15 +13,27 @@ from functools import partial
 from itertools import islice
 from pathlib import Path
 from urllib.error import URLError
-from urllib.request import Request, urlopen, urlretrieve
 
 from rich.console import Console
-from rich.progress import Progress
+from rich.progress import Progress, TaskID
 
-from sourced._internal import parallelization
+from sourced._internal import http, parallelization, serialization
 from sourced.dataset import db
 
 BASE_PYPI_URL = "https://pypi.org"
+_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Minimum number of seconds between two progress updates of a download
+_DOWNLOAD_PROGRESS_INTERVAL = 0.1
+# Minimum number of seconds between two checkpoints of the dataset metadata
+# while downloading, and the maximum share of time to spend on them.
+_CACHE_INTERVAL = 2.0
+_CACHE_TIME_SHARE = 0.1
+# Unpacking is CPU/disk bound, so letting all the (I/O sized) download
+# threads do it at once only makes them fight over the GIL and the disk.
+_UNPACK_SLOTS = threading.BoundedSemaphore(parallelization.workers(heavy="cpu"))
+# Rendering hundreds of concurrent downloads keeps Rich busy (and they
+# don't fit on the screen anyway), so only show this many at a time.
+_VISIBLE_DOWNLOAD_SLOTS = threading.BoundedSemaphore(8)
 _POPULAR_PYPI_PACKAGES_INDEX = (
     "https://hugovk.github.io/top-pypi-packages/top-pypi-packages-30-days.min.json"
 )
@@ -27,14 +41,17 @@ _POPULAR_PYPI_PACKAGES_INDEX = (
 
 @dataclass
 class SkipError(Exception):
-    project: str
+    source: db.Source
     description: str | None
 
-    @classmethod
-    def from_source(cls, source: db.Source, *args, **kwargs) -> SkipError:
-        source.status = db.SourceStatus.SKIPPED
-        return cls(source.name, *args, **kwargs)
 
+# The last component of every extension shutil knows how to unpack (e.g.
+# "gz" for ".tar.gz"), to cheaply rule out the rest (wheels, eggs, etc.)
+_UNPACKABLE_EXTENSIONS = frozenset(
+    extension.rpartition(".")[2]
+    for _, extensions, _ in shutil.get_unpack_formats()
+    for extension in extensions
+)
 
 PYPI_ALL_WHITELIST = os.getenv("PYPI_ALL_WHITELIST", None)
 PYPI_MAX_MBS = float(os.getenv("PYPI_MAX_MBS", float("inf"))) * (1024 * 1024)
@@ -47,16 +64,16 @@ def collect_all_pypi_packages(console: Console) -> Iterator[str]:
     else:
         allowed_packages = None
 
-    request = Request(
-        BASE_PYPI_URL + "/simple",
-        headers={
-            "Accept": "application/vnd.pypi.simple.v1+json",
-        },
-    )
     with console.status("Fetching the initial PyPI index..."):
-        with urlopen(request) as page:
-            pypi_index = json.load(page)
-            for project in pypi_index["projects"]:
+        with http.get(
+            BASE_PYPI_URL + "/simple/",
+            headers={
+                "Accept": "application/vnd.pypi.simple.v1+json",
+            },
+        ) as page:
+            # The whole index is tens of megabytes; decode it while it is
+            # still arriving rather than holding all of it in memory.
+            for project in serialization.iter_array(page, "projects"):
                 if allowed_packages and project["name"] not in allowed_packages:
                     continue
                 yield project["name"]
@@ -64,111 +81,161 @@ def collect_all_pypi_packages(console: Console) -> Iterator[str]:
 
 def collect_popular_pypi_packages(console: Console) -> Iterator[str]:
     with console.status("Fetching the initial PyPI index..."):
-        with urlopen(_POPULAR_PYPI_PACKAGES_INDEX) as page:
-            popular_packages = json.load(page)
+        with http.get(_POPULAR_PYPI_PACKAGES_INDEX) as page:
+            popular_packages = serialization.loads(page.read())
             for project in popular_packages["rows"]:
                 yield project["project"]
 
 
+def _find_unpack_format(filename: str) -> str | None:
+    if filename.rpartition(".")[2] not in _UNPACKABLE_EXTENSIONS:
+        return None
+    return shutil._find_unpack_format(filename)
+
+
 def prepare_download_url(source: db.Source) -> tuple[str, str]:
-    request = Request(BASE_PYPI_URL + f"/pypi/{source.name}/json")
     with suppress(URLError):
-        with urlopen(request) as page:
-            project_index = json.load(page)
+        with http.get(BASE_PYPI_URL + f"/pypi/{source.name}/json") as page:
+            project_index = serialization.loads(page.read())
             for file in reversed(project_index["urls"]):
                 if file["size"] >= PYPI_MAX_MBS:
                     continue
                 # TODO: Support any source wheels
-                if unpack_format := shutil._find_unpack_format(file["filename"]):
+                if unpack_format := _find_unpack_format(file["filename"]):
                     return file["url"], unpack_format
 
-    raise SkipError.from_source(source, "no suitable archive found")
+    raise SkipError(source, "no suitable archive found")
 
 
 @contextmanager
-def _clear_on_failure(
-    progress: Progress,
-    project_name: str,
-    cache_path: Path,
-) -> Iterator[None]:
-    download_task = progress.add_task(
-        f":alarm_clock: Preparing {project_name}", total=3
-    )
+def _clear_on_failure(cache_path: Path) -> Iterator[None]:
     try:
-        yield download_task
+        yield
     except BaseException:
         # Do not leave the cache in a corrupted state
         shutil.rmtree(cache_path, ignore_errors=True)
         raise
+
+
+@contextmanager
+def _download_task(progress: Progress, project_name: str) -> Iterator[TaskID | None]:
+    # Downloads that don't get a slot are only reflected on the total.
+    if not _VISIBLE_DOWNLOAD_SLOTS.acquire(blocking=False):
+        yield None
+        return
+
+    download_task = progress.add_task(
+        f":alarm_clock: Preparing {project_name}", total=3
+    )
+    try:
+        yield download_task
     finally:
         progress.remove_task(download_task)
+        _VISIBLE_DOWNLOAD_SLOTS.release()
 
 
 def download_target(
     progress: Progress,
     base_path: Path,
     source: db.Source,
-) -> None:
+) -> tuple[db.Source, db.SourceStatus]:
+    """Download and extract the given source under the base path. The
+    source itself is left untouched; its new status is returned for the
+    caller to apply."""
+
     source_path = base_path / source.name
-    if source_path.exists():
-        source.path = source_path
-        source.status = db.SourceStatus.DOWNLOADED
-        return
+    try:
+        source_path.mkdir(parents=True)
+    except FileExistsError:
+        return source, db.SourceStatus.DOWNLOADED
 
-    source_path.mkdir(parents=True)
-    with _clear_on_failure(progress, source.name, source_path) as download_task:
+    with _clear_on_failure(source_path), _download_task(
+        progress, source.name
+    ) as download_task:
         download_url, unpack_format = prepare_download_url(source)
 
-        progress.update(
-            download_task,
-            description=f":right_arrow_curving_down:, Downloading {source.name}",
-            advance=1,
-        )
-
-        total_seen = 0
-
-        def update_download(_, block_size: int, total_size: int) -> None:
-            nonlocal total_seen
-            total_seen += block_size
-
+        if download_task is not None:
             progress.update(
                 download_task,
-                description=(
-                    ":right_arrow_curving_down:, Downloading"
-                    f" {source.name} ({total_seen} / {total_size} bytes)"
-                ),
+                description=f":right_arrow_curving_down:, Downloading {source.name}",
+                advance=1,
             )
 
-        path, _ = urlretrieve(
-            download_url,
-            reporthook=update_download,
-        )
-
-        progress.update(
-            download_task,
-            description=f":open_book: Extracting {source.name}",
-            advance=1,
-        )
-        shutil.unpack_archive(path, source_path, format=unpack_format)
-        source.path = source_path
+        total_seen = 0
+        last_update = 0.0
+        # Read every chunk into the same buffer, instead of allocating a new
+        # bytes object for each one of them.
+        buffer = memoryview(bytearray(_DOWNLOAD_CHUNK_SIZE))
+        archive_fd, archive_path = tempfile.mkstemp()
+        try:
+            with open(archive_fd, "wb") as stream, http.get(download_url) as response:
+                total_size = int(response.getheader("Content-Length", -1))
+                while num_read := response.readinto(buffer):
+                    stream.write(buffer[:num_read])
+                    total_seen += num_read
+                    if download_task is None:
+                        continue
+
+                    # Re-rendering the progress for every chunk of every
+                    # concurrent download would keep a whole core busy.
+                    now = time.monotonic()
+                    if now - last_update < _DOWNLOAD_PROGRESS_INTERVAL:
+                        continue
+
+                    last_update = now
+                    progress.update(
+                        download_task,
+                        description=(
+                            ":right_arrow_curving_down:, Downloading"
+                            f" {source.name} ({total_seen} / {total_size} bytes)"
+                        ),
+                    )
+
+            if download_task is not None:
+                progress.update(
+                    download_task,
+                    description=f":open_book: Extracting {source.name}",
+                    advance=1,
+                )
+            with _UNPACK_SLOTS:
+                shutil.unpack_archive(archive_path, source_path, format=unpack_format)
+        finally:
+            os.unlink(archive_path)
 
         num_files = list(source_path.iterdir())
         if len(num_files) == 1 and num_files[0].is_dir():
             num_files[0].rename(source_path / "src")
-            source.status = db.SourceStatus.DOWNLOADED
+
+    return source, db.SourceStatus.DOWNLOADED
+
+
+def _list_directories(path: Path) -> set[str]:
+    # A single listing of the dataset directory is much cheaper than
+    # checking the existence of each source one by one.
+    with os.scandir(path) as entries:
+        return {entry.name for entry in entries if entry.is_dir()}
 
 
 def download_pypi_dataset(
     console: Console,
     dataset: db.Dataset,
 ) -> None:
-    awaiting_sources = [
-        source
-        for source in dataset.sources
-        if source.status is db.SourceStatus.AWAITING_DOWNLOAD
-    ]
+    downloaded_sources = _list_directories(dataset.path)
+    awaiting_sources = []
+    for source in dataset.sources:
+        if source.status is not db.SourceStatus.AWAITING_DOWNLOAD:
+            continue
 
+        if source.name in downloaded_sources:
+            source.status = db.SourceStatus.DOWNLOADED
+            source.path = dataset.path / source.name
+        else:
+            awaiting_sources.append(source)
+
+    cache_interval = _CACHE_INTERVAL
+    last_cached = time.monotonic()
     workers = parallelization.workers(heavy="io")
+    parallelization.raise_open_files_limit()
     with futures.ThreadPoolExecutor(max_workers=workers) as executor:
         with Progress(console=console) as progress:
             total_progress = progress.add_task(
@@ -176,23 +243,47 @@ def download_pypi_dataset(
                 total=len(dataset.sources),
                 completed=len(dataset.sources) - len(awaiting_sources),
             )
-            for completed_tasks in parallelization.buffered_execution(
-                executor,
-                iter(awaiting_sources),
-                partial(download_target, progress, dataset.path),
-                max_buffered_tasks=workers * 4,
-            ):
-                progress.update(total_progress, advance=len(completed_tasks))
-                for completed_task in completed_tasks:
-                    try:
-                        completed_task.result()
-                    except SkipError as error:
-                        console.print(
-                            f"Skipping {error.project}:"
-                            f" {error.description or 'unknown cause'}"
+            try:
+                for completed_tasks in parallelization.buffered_execution(
+                    executor,
+                    iter(awaiting_sources),
+                    partial(download_target, progress, dataset.path),
+                    max_buffered_tasks=workers * 4,
+                ):
+                    progress.update(total_progress, advance=len(completed_tasks))
+                    for completed_task in completed_tasks:
+                        try:
+                            source, status = completed_task.result()
+                        except SkipError as error:
+                            source, status = error.source, db.SourceStatus.SKIPPED
+                            console.print(
+                                f"Skipping {source.name}:"
+                                f" {error.description or 'unknown cause'}"
+                            )
+
+                        source.status = status
+                        if status is db.SourceStatus.DOWNLOADED:
+                            source.path = dataset.path / source.name
+
+                    # Caching re-writes the metadata of all the sources, so only
+                    # do it periodically rather than after each one of them.
+                    if time.monotonic() - last_cached >= cache_interval:
+                        started = time.monotonic()
+                        # The replacement is still atomic, it is only the final
+                        # checkpoint that needs to wait for the disk.
+                        dataset.cache(durable=False)
+                        last_cached = time.monotonic()
+
+                        # Large datasets take a while to cache, so space
+                        # the checkpoints out accordingly.
+                        cache_interval = max(
+                            _CACHE_INTERVAL,
+                            (last_cached - started) / _CACHE_TIME_SHARE,
                         )
-
-                    dataset.cache()
+            finally:
+                # Always checkpoint what we have so far, so that an interrupted
+                # run can pick up where it left off.
+                dataset.cache()
 
 
 def create_pypi_dataset(
@@ -229,8 +320,9 @@ def create_pypi_dataset(
                 for name in islice(sources, sample_size)
             ],
         )
+        downloaded_sources = _list_directories(dataset.path)
         for source in dataset.sources:
-            if (dataset.path / source.name).exists():
+            if source.name in downloaded_sources:
                 source.status = db.SourceStatus.DOWNLOADED
                 source.path = dataset.path / source.name
 
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import random
+import time
+from concurrent import futures
+
+import pytest
+
+from sourced._internal import parallelization
+
+
+@pytest.fixture
+def cpus(monkeypatch):
+    def set_cpus(count: int) -> None:
+        monkeypatch.setattr(parallelization, "available_cpus", lambda: count)
+
+    return set_cpus
+
+
+def test_workers(cpus):
+    cpus(4)
+    assert parallelization.workers(heavy="io") == 16
+    assert parallelization.workers(heavy="cpu") == 5
+    assert parallelization.workers(heavy="both") == 8
+
+    cpus(128)
+    assert parallelization.workers(heavy="io") == 256
+
+    with pytest.raises(ValueError):
+        parallelization.workers(heavy="network")
+
+
+def test_cgroup_cpu_limit(monkeypatch):
+    def read_text(path):
+        if path.name == "cpu.max":
+            return cpu_max
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(parallelization.Path, "read_text", read_text)
+
+    cpu_max = "max 100000\n"
+    assert parallelization._cgroup_cpu_limit() is None
+
+    cpu_max = "150000 100000\n"
+    assert parallelization._cgroup_cpu_limit() == 2
+
+
+def test_raise_open_files_limit(monkeypatch):
+    resource = pytest.importorskip("resource")
+
+    limits = {resource.RLIMIT_NOFILE: (256, 8192)}
+    monkeypatch.setattr(resource, "getrlimit", limits.__getitem__)
+    monkeypatch.setattr(resource, "setrlimit", limits.__setitem__)
+
+    parallelization.raise_open_files_limit()
+    assert limits[resource.RLIMIT_NOFILE] == (8192, 8192)
+
+    limits[resource.RLIMIT_NOFILE] = (256, resource.RLIM_INFINITY)
+    parallelization.raise_open_files_limit()
+    assert limits[resource.RLIMIT_NOFILE] == (
+        parallelization._OPEN_FILES_LIMIT,
+        resource.RLIM_INFINITY,
+    )
+
+    # Never lowered
+    limits[resource.RLIMIT_NOFILE] = (65536, 65536)
+    parallelization.raise_open_files_limit()
+    assert limits[resource.RLIMIT_NOFILE] == (65536, 65536)
+
+
+def test_buffered_execution():
+    num_pulled = 0
+
+    def inputs():
+        nonlocal num_pulled
+        for value in range(100):
+            num_pulled += 1
+            yield value
+
+    def square(value):
+        time.sleep(random.random() / 1000)
+        return value * value
+
+    results = []
+    with futures.ThreadPoolExecutor(max_workers=8) as executor:
+        for completed_tasks in parallelization.buffered_execution(
+            executor, inputs(), square, max_buffered_tasks=5
+        ):
+            assert completed_tasks
+            results.extend(task.result() for task in completed_tasks)
+            # Whatever is pulled from the iterator but not yielded yet is
+            # still running (the buffer is topped up before yielding).
+            assert num_pulled - len(results) <= 5
+
+    assert sorted(results) == [value * value for value in range(100)]
+
+    with futures.ThreadPoolExecutor(max_workers=8) as executor:
+        assert not list(
+            parallelization.buffered_execution(
+                executor, iter([]), square, max_buffered_tasks=5
+            )
+        )
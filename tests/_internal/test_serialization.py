@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import io
+import json
+
+import pytest
+
+from sourced._internal import serialization
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64 * 1024])
+def test_iter_array(chunk_size):
+    projects = [
+        {"name": "sourced", "_last-serial": 1234567},
+        {"name": "ünïcödé", "_last-serial": 8},
+        {"name": "nested", "meta": {"tags": ["a", "]", ","]}},
+        12345678,
+        "plain",
+        None,
+    ]
+    document = json.dumps(
+        {"meta": {"api-version": "1.0"}, "projects": projects},
+        ensure_ascii=False,
+        indent=2,
+    ).encode()
+
+    stream = io.BytesIO(document)
+    items = serialization.iter_array(stream, "projects", chunk_size=chunk_size)
+    assert list(items) == projects
+
+
+def test_iter_array_empty():
+    stream = io.BytesIO(b'{"projects": []}')
+    assert list(serialization.iter_array(stream, "projects")) == []
+
+
+@pytest.mark.parametrize(
+    "document",
+    [
+        b'{"meta": {}}',
+        b'{"projects": [{"name": "sourced"}',
+        b'{"projects": [{"name": "sour',
+    ],
+)
+def test_iter_array_invalid(document):
+    stream = io.BytesIO(document)
+    with pytest.raises(ValueError):
+        list(serialization.iter_array(stream, "projects", chunk_size=4))
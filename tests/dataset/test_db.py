@@ -7,6 +7,7 @@ from sourced.dataset.db import (
     Dataset,
     GlobalStore,
     Source,
+    SourceStatus,
 )
 
 
@@ -40,6 +41,27 @@ def test_cache(tmp_path):
     assert len(cached_dataset.sources)
 
 
+def test_cache_many_sources(tmp_path):
+    # Enough sources to span multiple encoding batches.
+    dataset = Dataset(
+        name="test",
+        path=tmp_path,
+        sources=[
+            Source(
+                name=f"source{index}",
+                path=tmp_path / f"source{index}" if index % 3 else None,
+                status=SourceStatus.DOWNLOADED if index % 3 else SourceStatus.SKIPPED,
+            )
+            for index in range(2500)
+        ],
+    )
+    dataset.cache()
+
+    cached_dataset = Dataset.from_cache(tmp_path)
+    assert cached_dataset.sources == dataset.sources
+    assert cached_dataset.to_json() == dataset.to_json()
+
+
 def test_global_store_non_existent(tmp_path):
     global_path = tmp_path / "global"
     global_path.mkdir(parents=True)
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+
+import pytest
+from rich.progress import Progress
+
+from sourced._internal import http
+from sourced.dataset import pypi
+from sourced.dataset.db import Source
+
+
+class MissingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"not found"
+        self.send_response(404)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def missing_url(monkeypatch):
+    for variable in ["http_proxy", "HTTP_PROXY"]:
+        monkeypatch.delenv(variable, raising=False)
+    monkeypatch.setattr(http._local, "connections", {}, raising=False)
+
+    with ThreadingHTTPServer(("127.0.0.1", 0), MissingHandler) as server:
+        thread = threading.Thread(
+            target=server.serve_forever, args=(0.01,), daemon=True
+        )
+        thread.start()
+        yield f"http://127.0.0.1:{server.server_port}/missing.tar.gz"
+        server.shutdown()
+
+
+def test_download_target_failure(tmp_path, monkeypatch, missing_url):
+    monkeypatch.setattr(
+        pypi, "prepare_download_url", lambda source: (missing_url, "gztar")
+    )
+
+    archive_fds = []
+    mkstemp = tempfile.mkstemp
+
+    def recording_mkstemp(*args, **kwargs):
+        archive_fd, archive_path = mkstemp(*args, **kwargs)
+        archive_fds.append(archive_fd)
+        return archive_fd, archive_path
+
+    monkeypatch.setattr(tempfile, "mkstemp", recording_mkstemp)
+
+    with Progress(disable=True) as progress:
+        for _ in range(5):
+            with pytest.raises(HTTPError):
+                pypi.download_target(progress, tmp_path, Source("project"))
+
+            # Neither the temporary archive nor the partial source is left behind.
+            with pytest.raises(OSError):
+                os.fstat(archive_fds[-1])
+            assert not (tmp_path / "project").exists()
+
+    assert len(archive_fds) == 5
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import os
+
+import pytest
+
+from sourced.analyze import (
+    _file_list_cache_path,
+    _read_file_list,
+    _write_file_list,
+    scan_projects,
+)
+from sourced.dataset.db import DEFAULT_DATASET_CACHE_FILE_NAME, Dataset, Source
+
+
+def test_scan_projects(tmp_path):
+    project = tmp_path / "project"
+    (project / "pkg" / "sub").mkdir(parents=True)
+    (project / "pkg" / "__init__.py").touch()
+    (project / "pkg" / "sub" / "mod.py").touch()
+    (project / "pkg" / "data.txt").touch()
+    (project / "setup.py").touch()
+
+    # Directories that can't contain any sources.
+    for skipped_dir in [".git", "__pycache__", "node_modules"]:
+        (project / skipped_dir).mkdir()
+        (project / skipped_dir / "skipped.py").touch()
+
+    other_project = tmp_path / "other_project"
+    other_project.mkdir()
+    (other_project / "main.py").touch()
+
+    files = scan_projects([str(project), str(other_project), str(tmp_path / "nope")])
+    assert sorted(files) == sorted(
+        [
+            str(project / "setup.py"),
+            str(project / "pkg" / "__init__.py"),
+            str(project / "pkg" / "sub" / "mod.py"),
+            str(other_project / "main.py"),
+        ]
+    )
+
+
+def test_file_list_cache(tmp_path):
+    cache_path = tmp_path / ".cache" / "files.2.txt"
+    stale_path = tmp_path / ".cache" / "files.1.txt"
+    stale_path.parent.mkdir()
+    stale_path.write_bytes(b"")
+
+    batches = [["a.py", "b c.py"], [], ["d/e.py"]]
+    written = _write_file_list(cache_path, iter(batches))
+    assert next(written) == batches[0]
+    assert not cache_path.exists()
+    assert list(written) == batches[1:]
+
+    assert _read_file_list(cache_path) == ["a.py", "b c.py", "d/e.py"]
+    assert not stale_path.exists()
+    assert _read_file_list(stale_path) is None
+
+
+def test_file_list_cache_unavailable(tmp_path):
+    # The cache is optional, the files should pass through regardless.
+    (tmp_path / ".cache").write_bytes(b"")
+    cache_path = tmp_path / ".cache" / "files.1.txt"
+
+    batches = [["a.py"], ["b.py"]]
+    assert list(_write_file_list(cache_path, iter(batches))) == batches
+    assert _read_file_list(cache_path) is None
+    assert _read_file_list(tmp_path) is None
+
+
+def test_file_list_cache_failing_batches(tmp_path):
+    cache_path = tmp_path / ".cache" / "files.1.txt"
+
+    def batches():
+        yield ["a.py"]
+        raise PermissionError
+
+    written = _write_file_list(cache_path, batches())
+    assert next(written) == ["a.py"]
+    with pytest.raises(PermissionError):
+        next(written)
+    assert not cache_path.exists()
+    assert list(cache_path.parent.iterdir()) == []
+
+
+def test_file_list_cache_path(tmp_path):
+    dataset = Dataset("dataset", tmp_path, [Source("a", tmp_path / "a")])
+    assert _file_list_cache_path(dataset) is None
+
+    dataset.cache()
+    cache_path = _file_list_cache_path(dataset)
+    assert cache_path.parent == tmp_path / ".cache"
+    assert _file_list_cache_path(dataset) == cache_path
+
+    # Re-written within the same timestamp tick
+    metadata_path = tmp_path / DEFAULT_DATASET_CACHE_FILE_NAME
+    metadata_stat = metadata_path.stat()
+    dataset.sources.append(Source("b", tmp_path / "b"))
+    dataset.cache()
+    os.utime(metadata_path, ns=(metadata_stat.st_atime_ns, metadata_stat.st_mtime_ns))
+    assert _file_list_cache_path(dataset) != cache_path